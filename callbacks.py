@@ -0,0 +1,33 @@
+from aiogram.filters.callback_data import CallbackData
+
+# Фабрики callback_data: keyboards.py упаковывает их через .pack(),
+# хендлеры в main.py фильтруют через .filter() и получают уже разобранный объект.
+# Упакованные строки совпадают с прежним форматом («game:5», «edit_name:7»,
+# «admin:toggle:5», …), так что кнопки в уже отправленных сообщениях продолжают работать.
+# Кнопки без параметров («cancel», «my_regs», «admin:back», …) остаются строками.
+
+class PageCB(CallbackData, prefix="page"):
+    page: int
+
+class GameCB(CallbackData, prefix="game"):
+    game_id: int
+
+class EditNameCB(CallbackData, prefix="edit_name"):
+    reg_id: int
+
+class EditPlayersCB(CallbackData, prefix="edit_players"):
+    reg_id: int
+
+class DeleteRegCB(CallbackData, prefix="delete_reg"):
+    reg_id: int
+
+# Админские — с общим префиксом «admin»; строки из двух частей («admin:back»)
+# эти фабрики не разбирают, поэтому с ними не пересекаются
+
+class AdminGameCB(CallbackData, prefix="admin"):
+    action: str  # game | toggle | teams | add_team | export | delete
+    game_id: int
+
+class AdminTeamCB(CallbackData, prefix="admin"):
+    action: str  # delteam
+    reg_id: int
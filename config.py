@@ -1,24 +1,43 @@
 import os
+import re
 from dataclasses import dataclass
+from functools import lru_cache
 from dotenv import load_dotenv
 
-load_dotenv()
-
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Settings:
     bot_token: str
-    admin_ids: tuple[int, ...]
+    admin_ids: frozenset[int]
     database_url: str
     tz: str
+    force_init_db: bool
+    redis_url: str | None
+    webhook_url: str | None
+    webhook_secret: str | None
+    webapp_host: str
+    webapp_port: int
+
+# Целые токены из цифр между запятыми; «-5», «1 2», «abc» пропускаются, как и раньше
+_ADMIN_ID_RE = re.compile(r"(?:^|,)\s*(\d+)\s*(?=,|$)")
 
-def _parse_admin_ids(raw: str | None) -> tuple[int, ...]:
+def _parse_admin_ids(raw: str | None) -> frozenset[int]:
     if not raw:
-        return tuple()
-    return tuple(int(x.strip()) for x in raw.split(",") if x.strip().isdigit())
+        return frozenset()
+    return frozenset(map(int, _ADMIN_ID_RE.findall(raw)))
 
-settings = Settings(
-    bot_token=os.environ["BOT_TOKEN"],
-    admin_ids=_parse_admin_ids(os.environ.get("ADMIN_IDS")),
-    database_url=os.environ.get("DATABASE_URL", "sqlite+aiosqlite:///./bot.db"),
-    tz=os.environ.get("TZ", "Europe/Minsk"),
-)
+# .env читается внутри get_settings: lru_cache и так гарантирует один вызов на процесс
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    load_dotenv()
+    return Settings(
+        bot_token=os.environ["BOT_TOKEN"],
+        admin_ids=_parse_admin_ids(os.environ.get("ADMIN_IDS")),
+        database_url=os.environ.get("DATABASE_URL", "sqlite+aiosqlite:///./bot.db"),
+        tz=os.environ.get("TZ", "Europe/Minsk"),
+        force_init_db=os.environ.get("FORCE_INIT_DB", "").lower() in {"1", "true", "yes"},
+        redis_url=os.environ.get("REDIS_URL") or None,
+        webhook_url=os.environ.get("WEBHOOK_URL") or None,
+        webhook_secret=os.environ.get("WEBHOOK_SECRET") or None,
+        webapp_host=os.environ.get("WEBAPP_HOST", "0.0.0.0"),
+        webapp_port=int(os.environ.get("WEBAPP_PORT", "8080")),
+    )
@@ -1,14 +1,40 @@
 from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import DeclarativeBase
-from sqlalchemy import event
+from sqlalchemy import event, inspect, text, Table, Column, Integer, select, delete, insert
 from sqlalchemy.engine import Engine
-from config import settings
+from sqlalchemy.exc import DBAPIError
+from config import get_settings
+
+settings = get_settings()
 
 class Base(DeclarativeBase):
     pass
 
-engine: AsyncEngine = create_async_engine(settings.database_url, echo=False, future=True)
-SessionLocal = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+# Версия схемы: увеличивать при каждом изменении моделей
+SCHEMA_VERSION = 6
+
+schema_meta = Table("schema_meta", Base.metadata, Column("version", Integer, nullable=False))
+
+_IS_SQLITE = settings.database_url.startswith("sqlite")
+
+if _IS_SQLITE:
+    # Ждём освобождения блокировки вместо мгновенного SQLITE_BUSY.
+    # Пул оставляем по умолчанию: StaticPool отдал бы одно соединение
+    # всем сессиям сразу и перемешал бы их транзакции.
+    _engine_kwargs = {"connect_args": {"timeout": 30}}
+else:
+    # ~30 исходящих сообщений/с у Bot API — соединений с запасом; pre-ping выключен
+    # (лишний SELECT 1 на каждый checkout), протухшие соединения отсекает pool_recycle
+    _engine_kwargs = {
+        "pool_size": 30,
+        "max_overflow": 20,
+        "pool_pre_ping": False,
+        "pool_recycle": 1800,
+    }
+
+engine: AsyncEngine = create_async_engine(settings.database_url, echo=False, future=True, **_engine_kwargs)
+# autoflush выключен: изменения сбрасываются в БД явным flush() или при commit
+SessionLocal = async_sessionmaker(engine, expire_on_commit=False, autoflush=False, class_=AsyncSession)
 
 # Включаем FK-каскады в SQLite
 @event.listens_for(Engine, "connect")
@@ -20,6 +46,94 @@ def _set_sqlite_pragma(dbapi_connection, connection_record):
     except Exception:
         pass
 
+# WAL + облегчённый fsync для SQLite: читатели не блокируют писателей
+if _IS_SQLITE:
+    @event.listens_for(engine.sync_engine, "connect")
+    def _set_sqlite_perf_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA mmap_size=268435456")
+        cursor.execute("PRAGMA cache_size=-64000")
+        cursor.close()
+
+async def _stored_schema_version() -> int | None:
+    # Отдельное соединение: в Postgres упавший запрос ломает всю транзакцию
+    async with engine.connect() as conn:
+        try:
+            return (await conn.execute(select(schema_meta.c.version))).scalar_one_or_none()
+        except DBAPIError:
+            return None
+
+# Миграции существующей базы: версия -> шаг над sync-соединением.
+# Выполняются по порядку для всех версий новее сохранённой, до create_all.
+# Новые таблицы и индексы создавать здесь не нужно — это сделают create_all
+# и _create_missing_indexes; сюда идёт то, чего они не умеют (DROP, ALTER, UPDATE).
+
+def _migrate_3(sync_conn):
+    # (game_id, status) заменён на (game_id, status, id); одиночный индекс по game_id
+    # покрывается префиксом составных индексов
+    sync_conn.execute(text("DROP INDEX IF EXISTS ix_reg_game_status"))
+    sync_conn.execute(text("DROP INDEX IF EXISTS ix_registrations_game_id"))
+
+def _migrate_4(sync_conn):
+    # status: VARCHAR 'confirmed'/'waitlist' -> SMALLINT 1/2 (models.RegStatus)
+    if sync_conn.dialect.name == "sqlite":
+        # Тип колонки в SQLite не меняется без пересоздания таблицы; значения
+        # переписываем на месте, сравнения с числом работают через аффинность
+        sync_conn.execute(text(
+            "UPDATE registrations SET status = CASE status WHEN 'waitlist' THEN 2 ELSE 1 END"
+        ))
+    else:
+        sync_conn.execute(text(
+            "ALTER TABLE registrations ALTER COLUMN status TYPE SMALLINT "
+            "USING CASE status WHEN 'waitlist' THEN 2 ELSE 1 END"
+        ))
+
+def _migrate_5(sync_conn):
+    # Денормализованные счётчики подтверждённых на games + заполнение по текущим регистрациям
+    sync_conn.execute(text("ALTER TABLE games ADD COLUMN confirmed_teams INTEGER NOT NULL DEFAULT 0"))
+    sync_conn.execute(text("ALTER TABLE games ADD COLUMN confirmed_players INTEGER NOT NULL DEFAULT 0"))
+    sync_conn.execute(text(
+        "UPDATE games SET "
+        "confirmed_teams = (SELECT COUNT(*) FROM registrations r "
+        "WHERE r.game_id = games.id AND r.status = 1), "
+        "confirmed_players = (SELECT COALESCE(SUM(r.players), 0) FROM registrations r "
+        "WHERE r.game_id = games.id AND r.status = 1)"
+    ))
+
+_MIGRATIONS = {
+    3: _migrate_3,
+    4: _migrate_4,
+    5: _migrate_5,
+}
+
+def _run_migrations(sync_conn, stored: int | None):
+    if stored is None:
+        # Базы, созданные до schema_meta, по схеме совпадают с версией 1; пустой базе мигрировать нечего
+        if not inspect(sync_conn).has_table("registrations"):
+            return
+        stored = 1
+    for version in range(stored + 1, SCHEMA_VERSION + 1):
+        step = _MIGRATIONS.get(version)
+        if step:
+            step(sync_conn)
+
+def _create_missing_indexes(sync_conn):
+    # create_all не добавляет новые индексы в уже существующие таблицы
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
 async def init_db():
+    # Если схема уже нужной версии, create_all (с интроспекцией каждой таблицы) не нужен
+    stored = await _stored_schema_version()
+    if not settings.force_init_db and stored == SCHEMA_VERSION:
+        return
     async with engine.begin() as conn:
+        await conn.run_sync(_run_migrations, stored)
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_create_missing_indexes)
+        await conn.execute(delete(schema_meta))
+        await conn.execute(insert(schema_meta).values(version=SCHEMA_VERSION))
@@ -1,85 +1,112 @@
+from functools import lru_cache
+from itertools import islice
 from typing import Iterable
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+from callbacks import PageCB, GameCB, EditNameCB, EditPlayersCB, DeleteRegCB, AdminGameCB, AdminTeamCB
+
+# Разметка собирается напрямую через InlineKeyboardMarkup: раскладка везде
+# известна заранее, так что InlineKeyboardBuilder с его adjust() не нужен.
+
+GAMES_PAGE_SIZE = 8
+
+_STATE_PREFIX = ("🔴 ", "🟢 ")  # индекс — is_active
+
+# Статичные кнопки админки: собираются один раз при импорте
+_BACK_BTN = InlineKeyboardButton(text="⬅️ Назад", callback_data="admin:back")
+_BACK_TO_LIST_BTN = InlineKeyboardButton(text="⬅️ Назад", callback_data="admin:list_games")
+_LOCK_LABELS = ("🔓 Включить приём", "🔒 Выключить приём")  # индекс — текущий is_active
+
+_MY_REGS_BTN = InlineKeyboardButton(text="🗂 Мои регистрации", callback_data="my_regs")
+
+# Пустые списки рендерятся одинаково — отдаём заранее собранные клавиатуры
+_EMPTY_GAMES_KB = InlineKeyboardMarkup(inline_keyboard=[[_MY_REGS_BTN]])
+_EMPTY_ADMIN_GAMES_KB = InlineKeyboardMarkup(inline_keyboard=[[_BACK_BTN]])
+
+# Клавиатуры без параметров (и reg_manage_kb по reg_id) кэшируются: один и тот же
+# объект разметки отдаётся всем хендлерам, поэтому менять его на месте нельзя.
+
+@lru_cache(maxsize=1)
 def cancel_kb() -> InlineKeyboardMarkup:
-    kb = InlineKeyboardBuilder()
-    kb.button(text="❌ Отмена", callback_data="cancel")
-    return kb.as_markup()
-
-def games_list_kb(games: list[tuple[int, str]], page: int = 1, page_size: int = 8) -> InlineKeyboardMarkup:
-    total = len(games)
-    start = (page - 1) * page_size
-    end = start + page_size
-    chunk = games[start:end]
-
-    kb = InlineKeyboardBuilder()
-    for gid, title in chunk:
-        kb.button(text=title, callback_data=f"game:{gid}")
-    kb.adjust(1)
-
-    nav_btns: list[InlineKeyboardButton] = []
-    if start > 0:
-        nav_btns.append(InlineKeyboardButton(text="⬅️", callback_data=f"page:{page-1}"))
-    if end < total:
-        nav_btns.append(InlineKeyboardButton(text="➡️", callback_data=f"page:{page+1}"))
-    nav_btns.append(InlineKeyboardButton(text="🗂 Мои регистрации", callback_data="my_regs"))
-
-    kb.row(*nav_btns)
-    return kb.as_markup()
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")],
+    ])
+
+def games_list_kb(games: list[tuple[int, str]], page: int = 1, page_size: int = GAMES_PAGE_SIZE) -> InlineKeyboardMarkup:
+    """
+    games — строки одной страницы из БД, запрошенные с LIMIT page_size + 1:
+    лишняя строка означает, что есть следующая страница.
+    """
+    # Пустая первая страница — готовая разметка; пустая дальняя (игры закрыли,
+    # пока пользователь листал) собирается обычным путём, чтобы осталась ⬅️
+    if not games and page == 1:
+        return _EMPTY_GAMES_KB
+
+    rows = [
+        [InlineKeyboardButton(text=title, callback_data=GameCB(game_id=gid).pack())]
+        for gid, title in islice(games, page_size)
+    ]
+
+    nav_btns: list[InlineKeyboardButton] = [
+        *([InlineKeyboardButton(text="⬅️", callback_data=PageCB(page=page - 1).pack())] if page > 1 else ()),
+        *([InlineKeyboardButton(text="➡️", callback_data=PageCB(page=page + 1).pack())] if len(games) > page_size else ()),
+        _MY_REGS_BTN,
+    ]
+
+    rows.append(nav_btns)
+    return InlineKeyboardMarkup(inline_keyboard=rows)
 
+@lru_cache(maxsize=4096)
 def reg_manage_kb(reg_id: int) -> InlineKeyboardMarkup:
-    kb = InlineKeyboardBuilder()
-    kb.button(text="✏️ Имя", callback_data=f"edit_name:{reg_id}")
-    kb.button(text="👥 Игроки", callback_data=f"edit_players:{reg_id}")
-    kb.button(text="🗑 Удалить", callback_data=f"delete_reg:{reg_id}")
-    # Если хочешь и эти кнопки в колонку — раскомментируй следующую строку
-    # kb.adjust(1); return kb.as_markup()
-    kb.adjust(3)
-    return kb.as_markup()
+    # Три кнопки в одну строку; для колонки — по кнопке на строку
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="✏️ Имя", callback_data=EditNameCB(reg_id=reg_id).pack()),
+        InlineKeyboardButton(text="👥 Игроки", callback_data=EditPlayersCB(reg_id=reg_id).pack()),
+        InlineKeyboardButton(text="🗑 Удалить", callback_data=DeleteRegCB(reg_id=reg_id).pack()),
+    ]])
 
+@lru_cache(maxsize=1)
 def admin_main_kb() -> InlineKeyboardMarkup:
-    kb = InlineKeyboardBuilder()
-    kb.button(text="➕ Добавить игру", callback_data="admin:add_game")
-    kb.button(text="📋 Список игр", callback_data="admin:list_games")
-    kb.adjust(1)
-    return kb.as_markup()
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="➕ Добавить игру", callback_data="admin:add_game")],
+        [InlineKeyboardButton(text="📋 Список игр", callback_data="admin:list_games")],
+    ])
 
 def admin_games_kb(items: Iterable[tuple[int, str, bool]]) -> InlineKeyboardMarkup:
-    kb = InlineKeyboardBuilder()
-    for gid, title, active in items:
-        state = "🟢" if active else "🔴"
-        kb.button(text=f"{state} {title}", callback_data=f"admin:game:{gid}")
-    kb.adjust(1)
-    kb.row(InlineKeyboardButton(text="⬅️ Назад", callback_data="admin:back"))
-    return kb.as_markup()
+    if not items:
+        return _EMPTY_ADMIN_GAMES_KB
+    rows = [
+        [InlineKeyboardButton(text=_STATE_PREFIX[active] + title, callback_data=AdminGameCB(action="game", game_id=gid).pack())]
+        for gid, title, active in items
+    ]
+    rows.append([_BACK_BTN])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
 
 def admin_game_actions_kb(game_id: int, active: bool) -> InlineKeyboardMarkup:
     """
-    🔸 Главное изменение: все кнопки идут одной колонкой (kb.adjust(1)),
+    🔸 Главное изменение: все кнопки идут одной колонкой (по кнопке в строке),
     чтобы текст полностью помещался и не обрезался «…».
     """
-    kb = InlineKeyboardBuilder()
-    kb.button(text=("🔒 Выключить приём" if active else "🔓 Включить приём"), callback_data=f"admin:toggle:{game_id}")
-    kb.button(text="📊 Команды", callback_data=f"admin:teams:{game_id}")
-    kb.button(text="➕ Добавить команду", callback_data=f"admin:add_team:{game_id}")
-    kb.button(text="📤 Экспорт CSV", callback_data=f"admin:export:{game_id}")
-    kb.button(text="🗑 Удалить игру", callback_data=f"admin:delete:{game_id}")
-    kb.adjust(1)  # ← одна кнопка в строку (колонка)
-    kb.row(InlineKeyboardButton(text="⬅️ Назад", callback_data="admin:list_games"))
-    return kb.as_markup()
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=_LOCK_LABELS[active], callback_data=AdminGameCB(action="toggle", game_id=game_id).pack())],
+        [InlineKeyboardButton(text="📊 Команды", callback_data=AdminGameCB(action="teams", game_id=game_id).pack())],
+        [InlineKeyboardButton(text="➕ Добавить команду", callback_data=AdminGameCB(action="add_team", game_id=game_id).pack())],
+        [InlineKeyboardButton(text="📤 Экспорт CSV", callback_data=AdminGameCB(action="export", game_id=game_id).pack())],
+        [InlineKeyboardButton(text="🗑 Удалить игру", callback_data=AdminGameCB(action="delete", game_id=game_id).pack())],
+        [_BACK_TO_LIST_BTN],
+    ])
 
 def admin_teams_list_kb(pairs: list[tuple[int, str]], game_id: int) -> InlineKeyboardMarkup:
     """
     pairs: [(reg_id, 'Team — 4 чел. ✅'), ...]
     Уже было колонкой; оставляем так.
     """
-    kb = InlineKeyboardBuilder()
-    for reg_id, label in pairs[:60]:
-        kb.button(text=f"🗑 {label}", callback_data=f"admin:delteam:{reg_id}")
-    kb.adjust(1)
-    kb.row(
-        InlineKeyboardButton(text="➕ Добавить команду", callback_data=f"admin:add_team:{game_id}"),
-        InlineKeyboardButton(text="⬅️ Назад", callback_data=f"admin:game:{game_id}")
-    )
-    return kb.as_markup()
+    rows = [
+        [InlineKeyboardButton(text=f"🗑 {label}", callback_data=AdminTeamCB(action="delteam", reg_id=reg_id).pack())]
+        for reg_id, label in pairs[:60]
+    ]
+    rows.append([
+        InlineKeyboardButton(text="➕ Добавить команду", callback_data=AdminGameCB(action="add_team", game_id=game_id).pack()),
+        InlineKeyboardButton(text="⬅️ Назад", callback_data=AdminGameCB(action="game", game_id=game_id).pack())
+    ])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
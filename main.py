@@ -1,119 +1,264 @@
 import asyncio
+import csv
+import io
+import time
+from collections import defaultdict
 from contextlib import asynccontextmanager
-from typing import Optional
+from typing import Optional, Sequence
+from urllib.parse import urlsplit
+
+from aiohttp import web
 
 from aiogram import Bot, Dispatcher, F, Router
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramRetryAfter
 from aiogram.client.default import DefaultBotProperties
 from aiogram.filters import Command, CommandStart
 from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
 from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import Message, CallbackQuery, FSInputFile
+from aiogram.types import Message, CallbackQuery, BufferedInputFile, BotCommand
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 
-from config import settings
+from config import get_settings
 from db import init_db, SessionLocal
-from models import Game, Registration
-from states import RegisterFlow, EditNameFlow, EditPlayersFlow, AddGameFlow, AdminAddTeamFlow
+from models import Game, Registration, RegStatus
+from states import (
+    ENTERING_TEAM_NAME, ENTERING_PLAYERS, ENTERING_NEW_NAME, ENTERING_NEW_PLAYERS,
+    ENTERING_TITLE, ENTERING_WHEN, ENTERING_LOCATION, ENTERING_TEAMS_CAPACITY,
+    ENTERING_PEOPLE_CAPACITY, ENTERING_MAX_PER_TEAM, CONFIRMING_ACTIVE, ADMIN_ENTERING_TEAM_NAME,
+    ADMIN_ENTERING_PLAYERS,
+)
 from keyboards import (
-    games_list_kb, reg_manage_kb, cancel_kb,
-    admin_main_kb, admin_games_kb, admin_game_actions_kb, admin_teams_list_kb
+    GAMES_PAGE_SIZE, games_list_kb, reg_manage_kb, cancel_kb,
+    admin_main_kb, admin_games_kb, admin_game_actions_kb, admin_teams_list_kb,
 )
-from utils import parse_datetime_maybe, fmt_dt
+from callbacks import PageCB, GameCB, EditNameCB, EditPlayersCB, DeleteRegCB, AdminGameCB, AdminTeamCB
+from middlewares import AdminOnlyMiddleware
+from utils import SKIP_TOKENS, parse_datetime_maybe, fmt_dt
 
-from sqlalchemy import select, func
+from sqlalchemy import Row, select, insert, update, delete, func, exists, lambda_stmt
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+
+settings = get_settings()
 
 
 # ----------------------------
 # Вспомогательные
 # ----------------------------
 
-def is_admin(user_id: int) -> bool:
-    return user_id in settings.admin_ids
-
-
 @asynccontextmanager
 async def session_scope() -> AsyncSession:
-    async with SessionLocal() as s:
-        try:
-            yield s
-            await s.commit()
-        except Exception:
-            await s.rollback()
-            raise
+    # begin(): commit при нормальном выходе, rollback при исключении
+    async with SessionLocal() as s, s.begin():
+        yield s
+
+
+# Кэш страниц списка активных игр: (page, page_size) -> (monotonic-время, строки).
+# Сбрасывается админскими хендлерами, которые меняют состав активных игр.
+_GAMES_CACHE_TTL = 5.0
+_games_cache: dict[tuple[int, int], tuple[float, list[Row]]] = {}
+
 
+def invalidate_games_cache() -> None:
+    _games_cache.clear()
 
-async def list_active_games(s: AsyncSession) -> list[Game]:
+
+async def list_active_games(s: AsyncSession, page: int = 1, page_size: int = GAMES_PAGE_SIZE) -> list[Row]:
+    """
+    Строки (id, title, when) одной страницы активных игр плюс одна лишняя —
+    признак следующей страницы.
+    """
+    key = (page, page_size)
+    cached = _games_cache.get(key)
+    if cached and time.monotonic() - cached[0] < _GAMES_CACHE_TTL:
+        return cached[1]
+    limit, offset = page_size + 1, (page - 1) * page_size
+    # lambda_stmt: SQL строится один раз, дальше меняются только параметры
+    res = await s.execute(lambda_stmt(
+        lambda: select(Game.id, Game.title, Game.when)
+        .where(Game.is_active == True)
+        .order_by(Game.when.asc().nulls_last(), Game.id.desc())
+        .limit(limit)
+        .offset(offset)
+    ))
+    # Строки не привязаны к сессии — их можно отдавать из кэша как есть
+    games = res.all()
+    _games_cache[key] = (time.monotonic(), games)
+    return games
+
+
+async def take_confirmed_slot(s: AsyncSession, game: Game, players: int) -> RegStatus:
+    """
+    Пытается занять место среди подтверждённых: проверка лимитов и инкремент
+    счётчиков игры — один условный UPDATE, строка игры заблокирована до конца
+    транзакции. Не прошло по лимитам (rowcount == 0) — лист ожидания.
+    """
+    conds = [Game.id == game.id]
+    if game.teams_capacity is not None:
+        conds.append(Game.confirmed_teams < game.teams_capacity)
+    if game.people_capacity is not None:
+        conds.append(Game.confirmed_players + players <= game.people_capacity)
     res = await s.execute(
-        select(Game).where(Game.is_active == True).order_by(Game.when.is_(None), Game.when.asc(), Game.id.desc())
+        update(Game)
+        .where(*conds)
+        .values(confirmed_teams=Game.confirmed_teams + 1, confirmed_players=Game.confirmed_players + players)
+        .execution_options(synchronize_session=False)
+    )
+    return RegStatus.CONFIRMED if res.rowcount else RegStatus.WAITLIST
+
+
+async def release_confirmed_slot(s: AsyncSession, game_id: int, players: int) -> None:
+    await s.execute(
+        update(Game)
+        .where(Game.id == game_id)
+        .values(confirmed_teams=Game.confirmed_teams - 1, confirmed_players=Game.confirmed_players - players)
+        .execution_options(synchronize_session=False)
     )
-    return list(res.scalars())
 
 
-async def count_confirmed_teams(s: AsyncSession, game_id: int) -> int:
-    q = select(func.count(Registration.id)).where(
-        Registration.game_id == game_id,
-        Registration.status == "confirmed"
+async def remove_registration(s: AsyncSession, reg_id: int, user_id: int | None = None) -> int | None:
+    """
+    Удаляет регистрацию (с user_id — только свою) и освобождает её место в счётчиках игры.
+    Возвращает game_id или None, если удалять нечего.
+    """
+    stmt = delete(Registration).where(Registration.id == reg_id)
+    if user_id is not None:
+        stmt = stmt.where(Registration.user_id == user_id)
+    row = (await s.execute(
+        stmt.returning(Registration.game_id, Registration.players, Registration.status)
+        .execution_options(synchronize_session=False)
+    )).one_or_none()
+    if row is None:
+        return None
+    if row.status is RegStatus.CONFIRMED:
+        await release_confirmed_slot(s, row.game_id, row.players)
+    return row.game_id
+
+
+async def game_stats(s: AsyncSession, game: Game) -> tuple[int, int, int]:
+    """
+    (подтверждённых команд, подтверждённых людей, команд в листе ожидания).
+    Подтверждённые — счётчики самой игры; считается только лист ожидания.
+    """
+    game_id = game.id
+    q = lambda_stmt(lambda: select(func.count()).where(
+        Registration.game_id == game_id, Registration.status == RegStatus.WAITLIST
+    ))
+    return game.confirmed_teams, game.confirmed_players, (await s.execute(q)).scalar_one()
+
+
+async def waitlist_counts(s: AsyncSession, game_ids: set[int]) -> dict[int, int]:
+    """Число команд в листе ожидания сразу для нескольких игр (GROUP BY game_id)."""
+    q = (
+        select(Registration.game_id, func.count())
+        .where(Registration.game_id.in_(game_ids), Registration.status == RegStatus.WAITLIST)
+        .group_by(Registration.game_id)
     )
-    return (await s.execute(q)).scalar_one()
+    return dict((await s.execute(q)).all())
 
 
-async def sum_confirmed_people(s: AsyncSession, game_id: int, exclude_reg_id: int | None = None) -> int:
-    conds = [Registration.game_id == game_id, Registration.status == "confirmed"]
-    if exclude_reg_id is not None:
-        conds.append(Registration.id != exclude_reg_id)
-    q = select(func.coalesce(func.sum(Registration.players), 0)).where(*conds)
-    return (await s.execute(q)).scalar_one()
+# Брифы: для пользователя (без лимитов) и для админа (с лимитами).
+# Шаблоны разбираются один раз; на каждый вызов — один format().
+_USER_BRIEF_TMPL = (
+    "<b>{title}</b>\n"
+    "📅 {when}\n"
+    "📍 {loc}\n"
+    "👥 Подтверждённых команд: {ct} (WL: {wl})\n"
+    "🧑‍🤝‍🧑 Подтверждённых людей: {cp}\n"
+)
+_ADMIN_BRIEF_TMPL = (
+    "<b>{title}</b>\n"
+    "📅 {when}\n"
+    "📍 {loc}\n"
+    "👥 Команд: {ct} / {tc} (WL: {wl})\n"
+    "🧑‍🤝‍🧑 Людей: {cp} / {pc} | Макс/команду: {maxpt}\n"
+)
+_TEAM_LINE_TMPL = "{i}. {name} — {players} чел. {mark}"
 
 
-# Брифы: для пользователя (без лимитов) и для админа (с лимитами)
 def user_game_brief(g: Game, confirmed_teams: int, confirmed_people: int, waitlist_teams: int) -> str:
-    when = fmt_dt(g.when)
-    loc = g.location or "—"
-    return (
-        f"<b>{g.title}</b>\n"
-        f"📅 {when}\n"
-        f"📍 {loc}\n"
-        f"👥 Подтверждённых команд: {confirmed_teams} (WL: {waitlist_teams})\n"
-        f"🧑‍🤝‍🧑 Подтверждённых людей: {confirmed_people}\n"
+    return _USER_BRIEF_TMPL.format(
+        title=g.title, when=fmt_dt(g.when), loc=g.location or "—",
+        ct=confirmed_teams, cp=confirmed_people, wl=waitlist_teams,
     )
 
 
 def admin_game_brief(g: Game, confirmed_teams: int, confirmed_people: int, waitlist_teams: int) -> str:
-    teams_cap = f"{g.teams_capacity}" if g.teams_capacity is not None else "∞"
-    people_cap = f"{g.people_capacity}" if g.people_capacity is not None else "∞"
-    maxpt = f"{g.max_players_per_team}" if g.max_players_per_team is not None else "∞"
-    when = fmt_dt(g.when)
-    loc = g.location or "—"
-    return (
-        f"<b>{g.title}</b>\n"
-        f"📅 {when}\n"
-        f"📍 {loc}\n"
-        f"👥 Команд: {confirmed_teams} / {teams_cap} (WL: {waitlist_teams})\n"
-        f"🧑‍🤝‍🧑 Людей: {confirmed_people} / {people_cap} | Макс/команду: {maxpt}\n"
+    return _ADMIN_BRIEF_TMPL.format(
+        title=g.title, when=fmt_dt(g.when), loc=g.location or "—",
+        ct=confirmed_teams, cp=confirmed_people, wl=waitlist_teams,
+        tc=g.teams_capacity if g.teams_capacity is not None else "∞",
+        pc=g.people_capacity if g.people_capacity is not None else "∞",
+        maxpt=g.max_players_per_team if g.max_players_per_team is not None else "∞",
+    )
+
+
+def format_teams_list(regs: Sequence[Row], cnt_all: int) -> str:
+    # regs — строки с полями team_name, players, status
+    if not regs:
+        return "Пока нет зарегистрированных команд."
+    body = "\n".join(
+        _TEAM_LINE_TMPL.format(i=i, name=r.team_name, players=r.players, mark="✅" if r.status is RegStatus.CONFIRMED else "⌛")
+        for i, r in enumerate(regs, start=1)
     )
+    tail = f"\n… и ещё {cnt_all - len(regs)} команд(ы)." if cnt_all > len(regs) else ""
+    return body + tail
 
 
 async def teams_list_text(s: AsyncSession, game_id: int, limit: int = 60) -> str:
+    # COUNT(*) OVER () считается до LIMIT: общее число команд приходит в каждой строке
     res = await s.execute(
-        select(Registration)
+        select(Registration.team_name, Registration.players, Registration.status, func.count().over().label("total"))
         .where(Registration.game_id == game_id)
-        .order_by(Registration.status.asc(), Registration.created_at.asc())
+        .order_by(Registration.status.asc(), Registration.created_at.asc(), Registration.id.asc())
         .limit(limit)
     )
-    regs = list(res.scalars())
-    if not regs:
-        return "Пока нет зарегистрированных команд."
-    lines = []
-    for i, r in enumerate(regs, start=1):
-        mark = "✅" if r.status == "confirmed" else "⌛"
-        lines.append(f"{i}. {r.team_name} — {r.players} чел. {mark}")
-    cnt_all = (await s.execute(
-        select(func.count(Registration.id)).where(Registration.game_id == game_id)
-    )).scalar_one()
-    tail = f"\n… и ещё {cnt_all - len(regs)} команд(ы)." if cnt_all > len(regs) else ""
-    return "\n".join(lines) + tail
+    regs = res.all()
+    return format_teams_list(regs, regs[0].total if regs else 0)
+
+
+async def admin_teams_listing(s: AsyncSession, game_id: int) -> tuple[list[tuple[int, str]], list[str]]:
+    """
+    Пары (reg_id, подпись) для admin_teams_list_kb и строки списка команд.
+    Регистрации читаются потоком пачками по 200, без промежуточного списка ORM-объектов.
+    """
+    result = await s.stream(
+        select(Registration.id, Registration.team_name, Registration.players, Registration.status)
+        .where(Registration.game_id == game_id)
+        .order_by(Registration.status.asc(), Registration.created_at.asc(), Registration.id.asc())
+        .execution_options(yield_per=200)
+    )
+    pairs: list[tuple[int, str]] = []
+    lines: list[str] = []
+    i = 0
+    async for reg_id, team_name, players, status in result:
+        i += 1
+        mark = "✅" if status is RegStatus.CONFIRMED else "⌛"
+        pairs.append((reg_id, f"#{i} {team_name} — {players} чел. {mark}"))
+        lines.append(f"{i}. {team_name} — {players} чел. {mark}")
+    return pairs, lines
+
+
+# Ограничение одновременных исходящих сообщений (лимит Bot API ~30 msg/s)
+_send_sem = asyncio.Semaphore(20)
+
+
+async def _bounded_send(message: Message, text: str, **kwargs) -> None:
+    async with _send_sem:
+        try:
+            await message.answer(text, **kwargs)
+        except TelegramRetryAfter as e:
+            # Ждём, сколько просит Telegram, и пробуем ещё раз — не выходя из семафора,
+            # чтобы ожидание тоже считалось в лимите. Повторный отказ глотаем:
+            # одна карточка под флуд-лимитом не должна ронять всю пачку
+            await asyncio.sleep(e.retry_after)
+            try:
+                await message.answer(text, **kwargs)
+            except TelegramRetryAfter:
+                pass
 
 
 async def next_admin_user_id(s: AsyncSession) -> int:
@@ -144,7 +289,7 @@ async def start(m: Message, state: FSMContext):
         if not games:
             await m.answer("Привет! Пока нет открытых игр для регистрации. Загляни позже.")
             return
-        data = [(g.id, f"{g.title} ({fmt_dt(g.when)})" if g.when else g.title) for g in games]
+        data = [(gid, f"{title} ({fmt_dt(when)})" if when else title) for gid, title, when in games]
         await m.answer("Выбери игру для регистрации:", reply_markup=games_list_kb(data, page=1))
 
 
@@ -153,91 +298,104 @@ async def whoami(m: Message):
     await m.answer(f"Твой Telegram user_id: <code>{m.from_user.id}</code>", parse_mode=ParseMode.HTML)
 
 
-@user_r.callback_query(F.data.startswith("page:"))
-async def paginate_games(cq: CallbackQuery):
-    page = int(cq.data.split(":")[1])
+# page < 1 бывает только в подделанном callback: дал бы отрицательный OFFSET и лишний ключ в кэше
+@user_r.callback_query(PageCB.filter(F.page >= 1))
+async def paginate_games(cq: CallbackQuery, callback_data: PageCB):
+    await cq.answer()
+    page = callback_data.page
     async with session_scope() as s:
-        games = await list_active_games(s)
-        data = [(g.id, f"{g.title} ({fmt_dt(g.when)})" if g.when else g.title) for g in games]
+        games = await list_active_games(s, page=page)
+        data = [(gid, f"{title} ({fmt_dt(when)})" if when else title) for gid, title, when in games]
         await cq.message.edit_reply_markup(reply_markup=games_list_kb(data, page=page))
-    await cq.answer()
 
 
 @user_r.callback_query(F.data == "my_regs")
 async def my_regs(cq: CallbackQuery):
+    await cq.answer()
     uid = cq.from_user.id
     async with session_scope() as s:
+        # От своей регистрации нужны только выводимые поля; игра целиком — для карточки
         res = await s.execute(
-            select(Registration, Game).join(Game, Registration.game_id == Game.id).where(Registration.user_id == uid)
+            select(Registration.id, Registration.team_name, Registration.players, Registration.status, Game)
+            .join(Game, Registration.game_id == Game.id)
+            .where(Registration.user_id == uid)
         )
         rows = res.all()
         if not rows:
             await cq.message.answer("У тебя пока нет регистраций.")
-            await cq.answer()
             return
 
-        for reg, game in rows:
-            confirmed_teams = await count_confirmed_teams(s, game.id)
-            confirmed_people = await sum_confirmed_people(s, game.id)
-            q_wait = select(func.count(Registration.id)).where(
-                Registration.game_id == game.id, Registration.status == "waitlist"
-            )
-            waitlist_teams = (await s.execute(q_wait)).scalar_one()
-            brief = user_game_brief(game, confirmed_teams, confirmed_people, waitlist_teams)
-            teams_text = await teams_list_text(s, game.id, limit=60)
+        # Статистика и составы всех игр пользователя — двумя запросами на всё
+        game_ids = {row.Game.id for row in rows}
+        waitlist_by_game = await waitlist_counts(s, game_ids)
+        res = await s.execute(
+            select(Registration.game_id, Registration.team_name, Registration.players, Registration.status)
+            .where(Registration.game_id.in_(game_ids))
+            .order_by(Registration.game_id, Registration.status.asc(), Registration.created_at.asc(), Registration.id.asc())
+        )
+        regs_by_game: dict[int, list[Row]] = defaultdict(list)
+        for r in res:
+            regs_by_game[r.game_id].append(r)
+
+        cards: list[tuple[str, int]] = []
+        for reg_id, team_name, players, status, game in rows:
+            brief = user_game_brief(game, game.confirmed_teams, game.confirmed_players, waitlist_by_game.get(game.id, 0))
+            game_regs = regs_by_game[game.id]
+            teams_text = format_teams_list(game_regs[:60], len(game_regs))
 
             text = (
                 f"{brief}"
                 f"<b>Твоя регистрация</b>\n"
-                f"• Команда: <b>{reg.team_name}</b>\n"
-                f"• Игроков: <b>{reg.players}</b>\n"
-                f"• Статус: <b>{reg.status}</b>\n\n"
+                f"• Команда: <b>{team_name}</b>\n"
+                f"• Игроков: <b>{players}</b>\n"
+                f"• Статус: <b>{status.label}</b>\n\n"
                 f"<b>Уже зарегистрированы:</b>\n{teams_text}"
             )
-            await cq.message.answer(text, reply_markup=reg_manage_kb(reg.id), parse_mode=ParseMode.HTML)
-    await cq.answer()
+            cards.append((text, reg_id))
+
+    # Карточки уходят параллельно (с ограничением), а не одна за другой
+    await asyncio.gather(*(
+        _bounded_send(cq.message, text, reply_markup=reg_manage_kb(reg_id), parse_mode=ParseMode.HTML)
+        for text, reg_id in cards
+    ))
 
 
-@user_r.callback_query(F.data.startswith("game:"))
-async def choose_game(cq: CallbackQuery, state: FSMContext):
-    game_id = int(cq.data.split(":")[1])
+@user_r.callback_query(GameCB.filter())
+async def choose_game(cq: CallbackQuery, callback_data: GameCB, state: FSMContext):
+    game_id = callback_data.game_id
+    uid = cq.from_user.id
+    # Игра и наличие регистрации пользователя на неё — одним запросом
+    has_reg = exists().where(Registration.user_id == uid, Registration.game_id == game_id)
     async with session_scope() as s:
-        game = await s.get(Game, game_id)
-        if not game or not game.is_active:
+        row = (await s.execute(select(Game, has_reg.label("has_reg")).where(Game.id == game_id))).one_or_none()
+        if row is None or not row.Game.is_active:
             await cq.answer("Эта игра недоступна.", show_alert=True)
             return
-        uid = cq.from_user.id
-        existing = await s.execute(select(Registration).where(Registration.user_id == uid, Registration.game_id == game_id))
-        if existing.scalar_one_or_none():
+        await cq.answer()
+        game = row.Game
+        if row.has_reg:
             await cq.message.answer("У тебя уже есть регистрация на эту игру. Открой «Мои регистрации», чтобы изменить или удалить.")
-            await cq.answer()
             return
 
-    await state.set_state(RegisterFlow.entering_team_name)
-    await state.update_data(game_id=game_id)
-
-    async with session_scope() as s:
-        g = await s.get(Game, game_id)
-        confirmed_teams = await count_confirmed_teams(s, game_id)
-        confirmed_people = await sum_confirmed_people(s, game_id)
-        q_wait = select(func.count(Registration.id)).where(Registration.game_id == game_id, Registration.status == "waitlist")
-        waitlist_teams = (await s.execute(q_wait)).scalar_one()
-        brief = user_game_brief(g, confirmed_teams, confirmed_people, waitlist_teams)
+        confirmed_teams, confirmed_people, waitlist_teams = await game_stats(s, game)
+        brief = user_game_brief(game, confirmed_teams, confirmed_people, waitlist_teams)
         teams_text = await teams_list_text(s, game_id, limit=60)
 
+    await state.set_state(ENTERING_TEAM_NAME)
+    await state.update_data(game_id=game_id)
+
     await cq.message.answer(brief + "\n<b>Уже зарегистрированы:</b>\n" + teams_text, parse_mode=ParseMode.HTML)
     await cq.message.answer("Теперь введи <b>название команды</b> (2–40 символов):", reply_markup=cancel_kb(), parse_mode=ParseMode.HTML)
-    await cq.answer()
 
 
 @user_r.callback_query(F.data == "cancel")
 async def cancel_any(cq: CallbackQuery, state: FSMContext):
+    await cq.answer()
     await state.clear()
     await cq.message.answer("Действие отменено.")
-    await cq.answer()
 
 
-@user_r.message(RegisterFlow.entering_team_name)
+@user_r.message(ENTERING_TEAM_NAME)
 async def team_name_step(m: Message, state: FSMContext):
     name = (m.text or "").strip()
     if not (2 <= len(name) <= 40):
@@ -251,7 +409,7 @@ async def team_name_step(m: Message, state: FSMContext):
             await m.answer("Это имя уже занято в этой игре. Введи другое имя команды:")
             return
     await state.update_data(team_name=name)
-    await state.set_state(RegisterFlow.entering_players)
+    await state.set_state(ENTERING_PLAYERS)
 
     async with session_scope() as s:
         g = await s.get(Game, game_id)
@@ -261,7 +419,7 @@ async def team_name_step(m: Message, state: FSMContext):
             await m.answer("Сколько человек в команде? (введите положительное число):")
 
 
-@user_r.message(RegisterFlow.entering_players)
+@user_r.message(ENTERING_PLAYERS)
 async def players_step(m: Message, state: FSMContext):
     try:
         players = int((m.text or "").strip())
@@ -290,28 +448,18 @@ async def players_step(m: Message, state: FSMContext):
             await m.answer("Число превышает допустимый предел для одной команды. Введите меньшее число:")
             return
 
-        status = "confirmed"
-        confirmed_teams = await count_confirmed_teams(s, game_id)
-        confirmed_people = await sum_confirmed_people(s, game_id)
-
-        teams_over = (game.teams_capacity is not None) and (confirmed_teams >= game.teams_capacity)
-        people_over = (game.people_capacity is not None) and ((confirmed_people + players) > game.people_capacity)
-
-        if teams_over or people_over:
-            status = "waitlist"
-
-        reg = Registration(
-            user_id=uid,
-            chat_id=chat_id,
-            game_id=game_id,
-            team_name=team_name,
-            players=players,
-            status=status,
-        )
-        s.add(reg)
         try:
-            await s.flush()
+            status = await take_confirmed_slot(s, game, players)
+            await s.execute(insert(Registration).values(
+                user_id=uid,
+                chat_id=chat_id,
+                game_id=game_id,
+                team_name=team_name,
+                players=players,
+                status=status,
+            ))
         except IntegrityError:
+            await s.rollback()
             await m.answer("Похоже, такая регистрация уже существует или имя занято. Попробуй снова.")
             return
 
@@ -322,23 +470,23 @@ async def players_step(m: Message, state: FSMContext):
             f"Когда: {fmt_dt(game.when)} | Где: {game.location or '—'}\n"
             f"Команда: <b>{team_name}</b>\n"
             f"Игроков: <b>{players}</b>\n"
-            f"Статус: <b>{status}</b>",
+            f"Статус: <b>{status.label}</b>",
             parse_mode=ParseMode.HTML
         )
 
 
 # --------- Редактирование / удаление регистрации пользователем ----------
 
-@user_r.callback_query(F.data.startswith("edit_name:"))
-async def edit_name_start(cq: CallbackQuery, state: FSMContext):
-    reg_id = int(cq.data.split(":")[1])
-    await state.set_state(EditNameFlow.entering_new_name)
+@user_r.callback_query(EditNameCB.filter())
+async def edit_name_start(cq: CallbackQuery, callback_data: EditNameCB, state: FSMContext):
+    await cq.answer()
+    reg_id = callback_data.reg_id
+    await state.set_state(ENTERING_NEW_NAME)
     await state.update_data(reg_id=reg_id)
     await cq.message.answer("Введи новое имя команды (2–40 символов):", reply_markup=cancel_kb())
-    await cq.answer()
 
 
-@user_r.message(EditNameFlow.entering_new_name)
+@user_r.message(ENTERING_NEW_NAME)
 async def edit_name_apply(m: Message, state: FSMContext):
     name = (m.text or "").strip()
     if not (2 <= len(name) <= 40):
@@ -353,37 +501,29 @@ async def edit_name_apply(m: Message, state: FSMContext):
             await m.answer("Регистрация не найдена.")
             await state.clear()
             return
-        exists = await s.execute(
-            select(Registration).where(
-                Registration.game_id == reg.game_id,
-                Registration.team_name == name,
-                Registration.id != reg.id
-            )
-        )
-        if exists.scalar_one_or_none():
-            await m.answer("Это имя занято в этой игре. Введи другое:")
-            return
+        # Занятость имени проверяет UNIQUE(game_id, team_name)
         reg.team_name = name
         try:
             await s.flush()
         except IntegrityError:
-            await m.answer("Не удалось сохранить. Попробуй другое имя.")
+            await s.rollback()
+            await m.answer("Это имя занято в этой игре. Введи другое:")
             return
 
     await state.clear()
     await m.answer("Имя команды обновлено.")
 
 
-@user_r.callback_query(F.data.startswith("edit_players:"))
-async def edit_players_start(cq: CallbackQuery, state: FSMContext):
-    reg_id = int(cq.data.split(":")[1])
-    await state.set_state(EditPlayersFlow.entering_new_players)
+@user_r.callback_query(EditPlayersCB.filter())
+async def edit_players_start(cq: CallbackQuery, callback_data: EditPlayersCB, state: FSMContext):
+    await cq.answer()
+    reg_id = callback_data.reg_id
+    await state.set_state(ENTERING_NEW_PLAYERS)
     await state.update_data(reg_id=reg_id)
     await cq.message.answer("Введи новое число игроков (положительное):", reply_markup=cancel_kb())
-    await cq.answer()
 
 
-@user_r.message(EditPlayersFlow.entering_new_players)
+@user_r.message(ENTERING_NEW_PLAYERS)
 async def edit_players_apply(m: Message, state: FSMContext):
     try:
         players = int((m.text or "").strip())
@@ -397,43 +537,46 @@ async def edit_players_apply(m: Message, state: FSMContext):
     reg_id = data["reg_id"]
     uid = m.from_user.id
     async with session_scope() as s:
-        reg = await s.get(Registration, reg_id)
+        reg = (await s.execute(
+            select(Registration)
+            .options(joinedload(Registration.game, innerjoin=True))
+            .where(Registration.id == reg_id)
+            .with_for_update(of=Registration)
+        )).scalar_one_or_none()
         if not reg or reg.user_id != uid:
             await m.answer("Регистрация не найдена.")
             await state.clear()
             return
 
-        game = await s.get(Game, reg.game_id)
+        game = reg.game
         if game.max_players_per_team is not None and players > game.max_players_per_team:
             await m.answer("Число превышает допустимый предел для одной команды. Введите меньшее число:")
             return
 
-        reg.players = players
-
-        confirmed_teams = await count_confirmed_teams(s, reg.game_id)
-        confirmed_people_excl = await sum_confirmed_people(s, reg.game_id, exclude_reg_id=reg.id)
-
-        teams_over = (game.teams_capacity is not None) and (confirmed_teams > game.teams_capacity)
-        people_over = (game.people_capacity is not None) and ((confirmed_people_excl + players) > game.people_capacity)
-
-        reg.status = "waitlist" if (teams_over or people_over) else "confirmed"
-        await s.flush()
+        # Место пересчитывается как для новой записи: своё старое освобождаем, новое занимаем
+        if reg.status is RegStatus.CONFIRMED:
+            await release_confirmed_slot(s, game.id, reg.players)
+        status = await take_confirmed_slot(s, game, players)
+        await s.execute(
+            update(Registration)
+            .where(Registration.id == reg.id)
+            .values(players=players, status=status)
+            .execution_options(synchronize_session=False)
+        )
     await state.clear()
     await m.answer("Число игроков обновлено.")
 
 
-@user_r.callback_query(F.data.startswith("delete_reg:"))
-async def delete_registration(cq: CallbackQuery):
-    reg_id = int(cq.data.split(":")[1])
+@user_r.callback_query(DeleteRegCB.filter())
+async def delete_registration(cq: CallbackQuery, callback_data: DeleteRegCB):
+    reg_id = callback_data.reg_id
     uid = cq.from_user.id
     async with session_scope() as s:
-        reg = await s.get(Registration, reg_id)
-        if not reg or reg.user_id != uid:
+        if await remove_registration(s, reg_id, user_id=uid) is None:
             await cq.answer("Не найдено.", show_alert=True)
             return
-        await s.delete(reg)
-    await cq.message.answer("Регистрация удалена.")
     await cq.answer("Удалено")
+    await cq.message.answer("Регистрация удалена.")
 
 
 # ----------------------------
@@ -441,129 +584,103 @@ async def delete_registration(cq: CallbackQuery):
 # ----------------------------
 
 admin_r = Router()
+# Проверка прав — один раз на апдейт, до фильтров; в хендлерах её нет
+admin_r.message.outer_middleware(AdminOnlyMiddleware())
+admin_r.callback_query.outer_middleware(AdminOnlyMiddleware())
 
 
 @admin_r.message(Command("admin"))
 async def admin_home(m: Message):
-    if not is_admin(m.from_user.id):
-        return
     await m.answer("Панель администратора:", reply_markup=admin_main_kb())
 
 
 @admin_r.callback_query(F.data == "admin:back")
 async def admin_back(cq: CallbackQuery):
-    if not is_admin(cq.from_user.id):
-        return
-    await cq.message.edit_text("Панель администратора:", reply_markup=admin_main_kb())
     await cq.answer()
+    await cq.message.edit_text("Панель администратора:", reply_markup=admin_main_kb())
 
 
 @admin_r.callback_query(F.data == "admin:list_games")
 async def admin_list_games(cq: CallbackQuery):
-    if not is_admin(cq.from_user.id):
-        return
+    await cq.answer()
     async with session_scope() as s:
-        res = await s.execute(select(Game).order_by(Game.id.desc()))
-        games = list(res.scalars())
-    items = [(g.id, f"{g.title} ({fmt_dt(g.when)})" if g.when else g.title, g.is_active) for g in games]
+        res = await s.execute(select(Game.id, Game.title, Game.when, Game.is_active).order_by(Game.id.desc()))
+        games = res.all()
+    items = [(gid, f"{title} ({fmt_dt(when)})" if when else title, active) for gid, title, when, active in games]
     text = "Список игр (нажми, чтобы управлять)"
     await cq.message.edit_text(text, reply_markup=admin_games_kb(items))
-    await cq.answer()
 
 
-@admin_r.callback_query(F.data.startswith("admin:game:"))
-async def admin_game_open(cq: CallbackQuery):
-    if not is_admin(cq.from_user.id):
-        return
-    gid = int(cq.data.split(":")[2])
+@admin_r.callback_query(AdminGameCB.filter(F.action == "game"))
+async def admin_game_open(cq: CallbackQuery, callback_data: AdminGameCB):
+    gid = callback_data.game_id
     async with session_scope() as s:
         g = await s.get(Game, gid)
         if not g:
             await cq.answer("Игра не найдена", show_alert=True)
             return
-        c_teams = await count_confirmed_teams(s, gid)
-        c_people = await sum_confirmed_people(s, gid)
-        q_wait = select(func.count(Registration.id)).where(Registration.game_id == gid, Registration.status == "waitlist")
-        w_teams = (await s.execute(q_wait)).scalar_one()
+        c_teams, c_people, w_teams = await game_stats(s, g)
         text = admin_game_brief(g, c_teams, c_people, w_teams)
         active = g.is_active
-    await cq.message.edit_text(text, reply_markup=admin_game_actions_kb(gid, active), parse_mode=ParseMode.HTML)
     await cq.answer()
+    await cq.message.edit_text(text, reply_markup=admin_game_actions_kb(gid, active), parse_mode=ParseMode.HTML)
 
 
-@admin_r.callback_query(F.data.startswith("admin:toggle:"))
-async def admin_toggle_game(cq: CallbackQuery):
-    if not is_admin(cq.from_user.id):
-        return
-    gid = int(cq.data.split(":")[2])
+@admin_r.callback_query(AdminGameCB.filter(F.action == "toggle"))
+async def admin_toggle_game(cq: CallbackQuery, callback_data: AdminGameCB):
+    gid = callback_data.game_id
     async with session_scope() as s:
         g = await s.get(Game, gid)
         if not g:
             await cq.answer("Не найдено", show_alert=True); return
         g.is_active = not g.is_active
         await s.flush()
-        c_teams = await count_confirmed_teams(s, gid)
-        c_people = await sum_confirmed_people(s, gid)
-        q_wait = select(func.count(Registration.id)).where(Registration.game_id == gid, Registration.status == "waitlist")
-        w_teams = (await s.execute(q_wait)).scalar_one()
+        c_teams, c_people, w_teams = await game_stats(s, g)
         text = admin_game_brief(g, c_teams, c_people, w_teams)
         active = g.is_active
-    await cq.message.edit_text(text, reply_markup=admin_game_actions_kb(gid, active), parse_mode=ParseMode.HTML)
+    invalidate_games_cache()
     await cq.answer("Готово")
+    await cq.message.edit_text(text, reply_markup=admin_game_actions_kb(gid, active), parse_mode=ParseMode.HTML)
 
 
-@admin_r.callback_query(F.data.startswith("admin:teams:"))
-async def admin_show_teams(cq: CallbackQuery):
-    if not is_admin(cq.from_user.id):
-        return
-    gid = int(cq.data.split(":")[2])
+@admin_r.callback_query(AdminGameCB.filter(F.action == "teams"))
+async def admin_show_teams(cq: CallbackQuery, callback_data: AdminGameCB):
+    gid = callback_data.game_id
     async with session_scope() as s:
-        res = await s.execute(
-            select(Registration).where(Registration.game_id == gid).order_by(Registration.status.asc(), Registration.created_at.asc())
-        )
-        regs = list(res.scalars())
         g = await s.get(Game, gid)
-    if not g:
-        await cq.answer("Игра не найдена", show_alert=True); return
-    if not regs:
+        if not g:
+            await cq.answer("Игра не найдена", show_alert=True); return
+        pairs, lines = await admin_teams_listing(s, gid)
+    await cq.answer()
+    if not pairs:
         await cq.message.answer("Нет регистраций на эту игру.")
-        await cq.answer(); return
+        return
 
-    pairs = []
-    lines = [f"<b>{g.title}</b> — список команд:"]
-    for i, r in enumerate(regs, start=1):
-        mark = "✅" if r.status == "confirmed" else "⌛"
-        label = f"#{i} {r.team_name} — {r.players} чел. {mark}"
-        pairs.append((r.id, label))
-        lines.append(f"{i}. {r.team_name} — {r.players} чел. {mark}")
+    text = "\n".join((f"<b>{g.title}</b> — список команд:", *lines))
+    await cq.message.answer(text, reply_markup=admin_teams_list_kb(pairs, gid), parse_mode=ParseMode.HTML)
 
-    await cq.message.answer("\n".join(lines), reply_markup=admin_teams_list_kb(pairs, gid), parse_mode=ParseMode.HTML)
-    await cq.answer()
 
-
-@admin_r.callback_query(F.data.startswith("admin:add_team:"))
-async def admin_add_team_start(cq: CallbackQuery, state: FSMContext):
-    if not is_admin(cq.from_user.id):
-        return
-    gid = int(cq.data.split(":")[2])
-    await state.set_state(AdminAddTeamFlow.entering_team_name)
+@admin_r.callback_query(AdminGameCB.filter(F.action == "add_team"))
+async def admin_add_team_start(cq: CallbackQuery, callback_data: AdminGameCB, state: FSMContext):
+    await cq.answer()
+    gid = callback_data.game_id
+    await state.set_state(ADMIN_ENTERING_TEAM_NAME)
     await state.update_data(game_id=gid)
     await cq.message.answer("Введите имя новой команды:", reply_markup=cancel_kb())
-    await cq.answer()
 
 
-@admin_r.message(AdminAddTeamFlow.entering_team_name)
+@admin_r.message(ADMIN_ENTERING_TEAM_NAME)
 async def admin_add_team_name(m: Message, state: FSMContext):
     name = (m.text or "").strip()
     if not (2 <= len(name) <= 80):
         await m.answer("Имя 2–80 символов. Попробуйте снова:")
         return
     await state.update_data(team_name=name)
-    await state.set_state(AdminAddTeamFlow.entering_players)
+    await state.set_state(ADMIN_ENTERING_PLAYERS)
     await m.answer("Сколько игроков в команде? (положительное число):")
 
 
-@admin_r.message(AdminAddTeamFlow.entering_players)
+@admin_r.message(ADMIN_ENTERING_PLAYERS)
 async def admin_add_team_players(m: Message, state: FSMContext):
     try:
         players = int((m.text or "").strip())
@@ -587,7 +704,7 @@ async def admin_add_team_players(m: Message, state: FSMContext):
         exists = await s.execute(select(Registration).where(Registration.game_id == gid, Registration.team_name == name))
         if exists.scalar_one_or_none():
             await m.answer("Имя уже занято. Введите другое:")
-            await state.set_state(AdminAddTeamFlow.entering_team_name)
+            await state.set_state(ADMIN_ENTERING_TEAM_NAME)
             return
 
         # Лимит на людей в одной команде
@@ -595,166 +712,138 @@ async def admin_add_team_players(m: Message, state: FSMContext):
             await m.answer("Число превышает допустимый предел для одной команды. Введите меньшее число:")
             return
 
-        # Решение о статусе (как для обычной регистрации)
-        status = "confirmed"
-        confirmed_teams = await count_confirmed_teams(s, gid)
-        confirmed_people = await sum_confirmed_people(s, gid)
-
-        teams_over = (g.teams_capacity is not None) and (confirmed_teams >= g.teams_capacity)
-        people_over = (g.people_capacity is not None) and ((confirmed_people + players) > g.people_capacity)
-
-        if teams_over or people_over:
-            status = "waitlist"
-
         # 🔧 КЛЮЧЕВАЯ ПРАВКА: уникальный отрицательный user_id для админских команд
         admin_uid = await next_admin_user_id(s)
 
-        reg = Registration(
-            user_id=admin_uid,
-            chat_id=0,
-            game_id=gid,
-            team_name=name,
-            players=players,
-            status=status
-        )
-        s.add(reg)
+        # Статус решается так же, как для обычной регистрации — по счётчикам игры
         try:
-            await s.flush()
+            status = await take_confirmed_slot(s, g, players)
+            await s.execute(insert(Registration).values(
+                user_id=admin_uid,
+                chat_id=0,
+                game_id=gid,
+                team_name=name,
+                players=players,
+                status=status,
+            ))
         except IntegrityError:
+            await s.rollback()
             await m.answer("Не удалось сохранить. Попробуйте ещё раз.")
             return
 
-        await m.answer(f"Команда «{name}» добавлена ({players} чел., статус: {status}).")
+        await m.answer(f"Команда «{name}» добавлена ({players} чел., статус: {status.label}).")
     await state.clear()
 
 
-@admin_r.callback_query(F.data.startswith("admin:delteam:"))
-async def admin_delete_team(cq: CallbackQuery):
-    if not is_admin(cq.from_user.id):
-        return
-    reg_id = int(cq.data.split(":")[2])
+@admin_r.callback_query(AdminTeamCB.filter(F.action == "delteam"))
+async def admin_delete_team(cq: CallbackQuery, callback_data: AdminTeamCB):
+    reg_id = callback_data.reg_id
     async with session_scope() as s:
-        reg = await s.get(Registration, reg_id)
-        if not reg:
+        gid = await remove_registration(s, reg_id)
+        if gid is None:
             await cq.answer("Команда не найдена", show_alert=True); return
-        gid = reg.game_id
-        await s.delete(reg)
     await cq.answer("Удалено")
 
     async with session_scope() as s:
         g = await s.get(Game, gid)
-        res = await s.execute(
-            select(Registration).where(Registration.game_id == gid).order_by(Registration.status.asc(), Registration.created_at.asc())
-        )
-        regs = list(res.scalars())
-    if not g:
-        await cq.message.answer("Игра не найдена.")
-        return
-    if not regs:
+        if not g:
+            await cq.message.answer("Игра не найдена.")
+            return
+        pairs, lines = await admin_teams_listing(s, gid)
+    if not pairs:
         await cq.message.answer("Список команд пуст.")
         return
 
-    pairs = []
-    lines = [f"<b>{g.title}</b> — список команд:"]
-    for i, r in enumerate(regs, start=1):
-        mark = "✅" if r.status == "confirmed" else "⌛"
-        label = f"#{i} {r.team_name} — {r.players} чел. {mark}"
-        pairs.append((r.id, label))
-        lines.append(f"{i}. {r.team_name} — {r.players} чел. {mark}")
-
-    await cq.message.answer("\n".join(lines), reply_markup=admin_teams_list_kb(pairs, gid), parse_mode=ParseMode.HTML)
+    text = "\n".join((f"<b>{g.title}</b> — список команд:", *lines))
+    await cq.message.answer(text, reply_markup=admin_teams_list_kb(pairs, gid), parse_mode=ParseMode.HTML)
 
 
-@admin_r.callback_query(F.data.startswith("admin:export:"))
-async def admin_export_csv(cq: CallbackQuery):
-    if not is_admin(cq.from_user.id):
-        return
-    import pandas as pd
-    gid = int(cq.data.split(":")[2])
+@admin_r.callback_query(AdminGameCB.filter(F.action == "export"))
+async def admin_export_csv(cq: CallbackQuery, callback_data: AdminGameCB):
+    # Отвечаем сразу: выгрузка может идти дольше, чем Telegram ждёт ответа на callback
+    await cq.answer("Готовлю экспорт…")
+    gid = callback_data.game_id
+    # CSV собираем в памяти и отправляем без временного файла на диске;
+    # строки пишутся прямо из потока результатов, без списка всех регистраций
+    buf = io.StringIO()
+    w = csv.writer(buf)
     async with session_scope() as s:
-        res = await s.execute(
-            select(Registration).where(Registration.game_id == gid).order_by(Registration.created_at.asc())
-        )
-        regs = list(res.scalars())
         g = await s.get(Game, gid)
-    if not g:
-        await cq.answer("Игра не найдена", show_alert=True); return
-    if not regs:
-        await cq.answer("Нет данных для экспорта", show_alert=True); return
-    df = pd.DataFrame([{
-        "team_name": r.team_name,
-        "players": r.players,
-        "status": r.status,
-        "created_at": r.created_at,
-        "updated_at": r.updated_at,
-        "user_id": r.user_id,
-        "chat_id": r.chat_id
-    } for r in regs])
+        if not g:
+            await cq.message.answer("Игра не найдена."); return
+        # Пустую игру видно по EXISTS, без открытия потока
+        if not await s.scalar(select(exists().where(Registration.game_id == gid))):
+            await cq.message.answer("Нет данных для экспорта."); return
+        w.writerow(["team_name", "players", "status", "created_at", "updated_at", "user_id", "chat_id"])
+        result = await s.stream_scalars(
+            select(Registration)
+            .where(Registration.game_id == gid)
+            .order_by(Registration.created_at.asc(), Registration.id.asc())
+            .execution_options(yield_per=200)
+        )
+        async for r in result:
+            w.writerow((r.team_name, r.players, r.status.label, r.created_at, r.updated_at, r.user_id, r.chat_id))
     filename = f"export_game_{gid}.csv"
-    df.to_csv(filename, index=False)
-    await cq.message.answer_document(document=FSInputFile(filename), caption=f"Экспорт по игре: {g.title}")
-    await cq.answer("Экспорт готов")
+    document = BufferedInputFile(buf.getvalue().encode("utf-8"), filename=filename)
+    await cq.message.answer_document(document=document, caption=f"Экспорт по игре: {g.title}")
 
 
-@admin_r.callback_query(F.data.startswith("admin:delete:"))
-async def admin_delete_game(cq: CallbackQuery):
-    if not is_admin(cq.from_user.id):
-        return
-    gid = int(cq.data.split(":")[2])
+@admin_r.callback_query(AdminGameCB.filter(F.action == "delete"))
+async def admin_delete_game(cq: CallbackQuery, callback_data: AdminGameCB):
+    gid = callback_data.game_id
     async with session_scope() as s:
         g = await s.get(Game, gid)
         if not g:
             await cq.answer("Не найдено", show_alert=True); return
         await s.delete(g)  # ondelete=CASCADE + PRAGMA foreign_keys=ON
-    await cq.message.answer("Игра и все её регистрации удалены.")
+    invalidate_games_cache()
     await cq.answer("Готово")
+    await cq.message.answer("Игра и все её регистрации удалены.")
 
 
 # ---- Мастер добавления игры ----
 
 @admin_r.callback_query(F.data == "admin:add_game")
 async def add_game_start(cq: CallbackQuery, state: FSMContext):
-    if not is_admin(cq.from_user.id):
-        return
-    await state.set_state(AddGameFlow.entering_title)
-    await cq.message.answer("Введи <b>название</b> игры:", parse_mode=ParseMode.HTML, reply_markup=cancel_kb())
     await cq.answer()
+    await state.set_state(ENTERING_TITLE)
+    await cq.message.answer("Введи <b>название</b> игры:", parse_mode=ParseMode.HTML, reply_markup=cancel_kb())
 
 
-@admin_r.message(AddGameFlow.entering_title)
+@admin_r.message(ENTERING_TITLE)
 async def add_game_title(m: Message, state: FSMContext):
     title = (m.text or "").strip()
     if not (2 <= len(title) <= 200):
         await m.answer("Название 2–200 символов. Попробуй ещё раз:")
         return
     await state.update_data(title=title)
-    await state.set_state(AddGameFlow.entering_when)
+    await state.set_state(ENTERING_WHEN)
     await m.answer("Когда? Введи дату/время (напр. 2025-10-01 19:00) или напиши «skip»:")
 
 
-@admin_r.message(AddGameFlow.entering_when)
+@admin_r.message(ENTERING_WHEN)
 async def add_game_when(m: Message, state: FSMContext):
     dt = parse_datetime_maybe(m.text or "")
     await state.update_data(when=dt.isoformat() if dt else None)
-    await state.set_state(AddGameFlow.entering_location)
+    await state.set_state(ENTERING_LOCATION)
     await m.answer("Где проходит игра? (или «skip»)")
 
 
-@admin_r.message(AddGameFlow.entering_location)
+@admin_r.message(ENTERING_LOCATION)
 async def add_game_location(m: Message, state: FSMContext):
     loc = (m.text or "").strip()
-    if loc.lower() in {"skip", "пропуск", "нет", "не", ""}:
+    if loc.lower() in SKIP_TOKENS:
         loc = None
     await state.update_data(location=loc)
-    await state.set_state(AddGameFlow.entering_teams_capacity)
+    await state.set_state(ENTERING_TEAMS_CAPACITY)
     await m.answer("Лимит по <b>числу команд</b>? Введи число или «skip»:", parse_mode=ParseMode.HTML)
 
 
-@admin_r.message(AddGameFlow.entering_teams_capacity)
+@admin_r.message(ENTERING_TEAMS_CAPACITY)
 async def add_game_teams_capacity(m: Message, state: FSMContext):
     raw = (m.text or "").strip().lower()
     teams_cap: Optional[int] = None
-    if raw not in {"skip", "пропуск", "нет", "не", ""}:
+    if raw not in SKIP_TOKENS:
         try:
             teams_cap = int(raw)
             if teams_cap <= 0:
@@ -764,15 +853,15 @@ async def add_game_teams_capacity(m: Message, state: FSMContext):
             await m.answer("Нужно число или «skip». Попробуй снова:")
             return
     await state.update_data(teams_capacity=teams_cap)
-    await state.set_state(AddGameFlow.entering_people_capacity)
+    await state.set_state(ENTERING_PEOPLE_CAPACITY)
     await m.answer("Лимит по <b>общему числу людей</b>? Введи число или «skip»:", parse_mode=ParseMode.HTML)
 
 
-@admin_r.message(AddGameFlow.entering_people_capacity)
+@admin_r.message(ENTERING_PEOPLE_CAPACITY)
 async def add_game_people_capacity(m: Message, state: FSMContext):
     raw = (m.text or "").strip().lower()
     people_cap: Optional[int] = None
-    if raw not in {"skip", "пропуск", "нет", "не", ""}:
+    if raw not in SKIP_TOKENS:
         try:
             people_cap = int(raw)
             if people_cap <= 0:
@@ -782,15 +871,15 @@ async def add_game_people_capacity(m: Message, state: FSMContext):
             await m.answer("Нужно число или «skip». Попробуй снова:")
             return
     await state.update_data(people_capacity=people_cap)
-    await state.set_state(AddGameFlow.entering_max_per_team)
+    await state.set_state(ENTERING_MAX_PER_TEAM)
     await m.answer("Макс. людей <b>в одной команде</b>? Введи число или «skip»:", parse_mode=ParseMode.HTML)
 
 
-@admin_r.message(AddGameFlow.entering_max_per_team)
+@admin_r.message(ENTERING_MAX_PER_TEAM)
 async def add_game_max_per_team(m: Message, state: FSMContext):
     raw = (m.text or "").strip().lower()
     maxpt: Optional[int] = None
-    if raw not in {"skip", "пропуск", "нет", "не", ""}:
+    if raw not in SKIP_TOKENS:
         try:
             maxpt = int(raw)
             if maxpt <= 0:
@@ -800,11 +889,11 @@ async def add_game_max_per_team(m: Message, state: FSMContext):
             await m.answer("Нужно число или «skip». Попробуй снова:")
             return
     await state.update_data(max_players_per_team=maxpt)
-    await state.set_state(AddGameFlow.confirming_active)
+    await state.set_state(CONFIRMING_ACTIVE)
     await m.answer("Активировать приём регистраций сейчас? (да/нет)")
 
 
-@admin_r.message(AddGameFlow.confirming_active)
+@admin_r.message(CONFIRMING_ACTIVE)
 async def add_game_confirm(m: Message, state: FSMContext):
     from datetime import datetime
     ans = (m.text or "").strip().lower()
@@ -825,12 +914,10 @@ async def add_game_confirm(m: Message, state: FSMContext):
         s.add(g)
         await s.flush()
 
-        c_teams = await count_confirmed_teams(s, g.id)
-        c_people = await sum_confirmed_people(s, g.id)
-        q_wait = select(func.count(Registration.id)).where(Registration.game_id == g.id, Registration.status == "waitlist")
-        w_teams = (await s.execute(q_wait)).scalar_one()
+        c_teams, c_people, w_teams = await game_stats(s, g)
 
         await m.answer("Игра добавлена:\n" + admin_game_brief(g, c_teams, c_people, w_teams), parse_mode=ParseMode.HTML)
+    invalidate_games_cache()
     await state.clear()
 
 
@@ -838,25 +925,43 @@ async def add_game_confirm(m: Message, state: FSMContext):
 # /help
 # ----------------------------
 
+_HELP_TEXT = (
+    "Что я умею:\n"
+    "• /start — выбрать игру и зарегистрировать команду\n"
+    "• /whoami — показать твой user_id\n"
+    "• Мои регистрации — изменить имя/кол-во игроков или удалить (показывает список команд на игре)\n"
+    "• Админам: /admin — управление играми (лимиты задаются при создании; можно добавлять/удалять команды)\n"
+)
+
+# Меню команд в клиентах Telegram; регистрируется один раз при старте
+_BOT_COMMANDS = [
+    BotCommand(command="start", description="Выбрать игру и зарегистрировать команду"),
+    BotCommand(command="help", description="Что умеет бот"),
+    BotCommand(command="whoami", description="Показать мой user_id"),
+    BotCommand(command="admin", description="Админ-панель"),
+]
+
+
 @user_r.message(Command("help"))
 async def help_cmd(m: Message):
-    text = (
-        "Что я умею:\n"
-        "• /start — выбрать игру и зарегистрировать команду\n"
-        "• /whoami — показать твой user_id\n"
-        "• Мои регистрации — изменить имя/кол-во игроков или удалить (показывает список команд на игре)\n"
-        "• Админам: /admin — управление играми (лимиты задаются при создании; можно добавлять/удалять команды)\n"
-    )
-    await m.answer(text)
+    await m.answer(_HELP_TEXT)
 
 
 # ----------------------------
 # Точка входа
 # ----------------------------
 
+def make_storage() -> BaseStorage:
+    # С REDIS_URL состояние FSM общее для всех процессов бота; без него — в памяти процесса
+    if settings.redis_url:
+        from aiogram.fsm.storage.redis import RedisStorage
+        return RedisStorage.from_url(settings.redis_url, key_builder=DefaultKeyBuilder(with_bot_id=True))
+    return MemoryStorage()
+
+
 async def main():
     await init_db()
-    dp = Dispatcher(storage=MemoryStorage())
+    dp = Dispatcher(storage=make_storage())
 
     dp.include_router(user_r)
     dp.include_router(admin_r)
@@ -865,9 +970,37 @@ async def main():
         token=settings.bot_token,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
+    await bot.set_my_commands(_BOT_COMMANDS)
+    # Только те типы апдейтов, на которые есть хендлеры
+    allowed_updates = dp.resolve_used_update_types()
     print("Bot is running...")
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    if settings.webhook_url:
+        await run_webhook(dp, bot, allowed_updates)
+    else:
+        await bot.delete_webhook(drop_pending_updates=True)
+        await dp.start_polling(bot, allowed_updates=allowed_updates)
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, allowed_updates: list[str]) -> None:
+    # С WEBHOOK_URL Telegram сам присылает апдейты на aiohttp-сервер, без getUpdates
+    await bot.set_webhook(
+        settings.webhook_url,
+        allowed_updates=allowed_updates,
+        drop_pending_updates=True,
+        secret_token=settings.webhook_secret,
+    )
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=settings.webhook_secret).register(
+        app, path=urlsplit(settings.webhook_url).path or "/"
+    )
+    setup_application(app, dp, bot=bot)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, settings.webapp_host, settings.webapp_port).start()
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,24 @@
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User
+
+from config import get_settings
+
+settings = get_settings()
+
+class AdminOnlyMiddleware(BaseMiddleware):
+    """
+    Внешний middleware для админского роутера: апдейты не от админов
+    отбрасываются до фильтров и хендлеров.
+    """
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        user: User | None = data.get("event_from_user")
+        if user is None or user.id not in settings.admin_ids:
+            return None
+        return await handler(event, data)
@@ -1,11 +1,64 @@
 from datetime import datetime
+from enum import IntEnum
 from typing import Optional
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import Integer, String, DateTime, Boolean, ForeignKey, UniqueConstraint
+from sqlalchemy import Integer, SmallInteger, String, DateTime, Boolean, ForeignKey, UniqueConstraint, Index
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.types import TypeDecorator
 from db import Base
 
+class RegStatus(IntEnum):
+    # Порядок значений задаёт порядок в списках: сначала подтверждённые
+    CONFIRMED = 1
+    WAITLIST = 2
+
+    @property
+    def label(self) -> str:
+        # Подпись для сообщений и CSV — прежние строковые значения статуса
+        return self.name.lower()
+
+class RegStatusType(TypeDecorator):
+    """
+    RegStatus в колонке SMALLINT. В SQLite колонка, переведённая миграцией из
+    VARCHAR, сохраняет TEXT-аффинность и отдаёт '1'/'2' — поэтому int() при чтении.
+    """
+    impl = SmallInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else int(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else RegStatus(int(value))
+
+class utcnow(FunctionElement):
+    """
+    Текущее время в UTC на стороне БД — колонки naive DateTime, как и прежний
+    datetime.utcnow. В SQLite CURRENT_TIMESTAMP и так в UTC; now() в PostgreSQL —
+    в часовом поясе сессии, поэтому там явно переводим в UTC.
+    """
+    type = DateTime()
+    inherit_cache = True
+
+@compiles(utcnow)
+def _utcnow_default(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
+@compiles(utcnow, "postgresql")
+def _utcnow_postgresql(element, compiler, **kw):
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
+# Время создания/изменения ставит сама БД: default=utcnow() уходит в INSERT как
+# SQL-выражение (работает и на таблицах, созданных без DDL DEFAULT),
+# server_default — DEFAULT в DDL для новых таблиц.
+
 class Game(Base):
     __tablename__ = "games"
+    __table_args__ = (
+        # Список активных игр: WHERE is_active = true ORDER BY when — диапазон по индексу без сортировки
+        Index("ix_games_active_when", "is_active", "when"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     title: Mapped[str] = mapped_column(String(200), nullable=False)
@@ -18,12 +71,21 @@ class Game(Base):
     max_players_per_team: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)  # макс. людей в команде
 
     is_active: Mapped[bool] = mapped_column(Boolean, default=True, nullable=False)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
 
+    # Занятость среди подтверждённых; ведётся путём записи регистраций в main.py
+    # (take_confirmed_slot / release_confirmed_slot), а не агрегатом по registrations
+    confirmed_teams: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+    confirmed_players: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=utcnow(), server_default=utcnow(), nullable=False)
+
+    # Коллекцию не подгружаем неявно (в т.ч. по одному SELECT на игру в списках):
+    # нужные регистрации выбираются отдельным запросом по game_id / selectinload.
+    # Удаление игры коллекцию не трогает — passive_deletes отдаёт каскад в БД.
     registrations: Mapped[list["Registration"]] = relationship(
         back_populates="game",
         cascade="all, delete-orphan",
         passive_deletes=True,
+        lazy="raise",
     )
 
 class Registration(Base):
@@ -31,16 +93,23 @@ class Registration(Base):
     __table_args__ = (
         UniqueConstraint("game_id", "user_id", name="uix_reg_game_user"),
         UniqueConstraint("game_id", "team_name", name="uix_reg_game_team"),
+        # Счётчики/суммы по игре всегда фильтруются по (game_id, status); id в хвосте —
+        # для выборок подтверждённых по порядку без сортировки. Индекс по одному
+        # game_id не нужен: он префикс этого индекса и uix_reg_game_user.
+        Index("ix_reg_game_status_id", "game_id", "status", "id"),
     )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(Integer, nullable=False, index=True)
     chat_id: Mapped[int] = mapped_column(Integer, nullable=False)
-    game_id: Mapped[int] = mapped_column(ForeignKey("games.id", ondelete="CASCADE"), nullable=False, index=True)
+    game_id: Mapped[int] = mapped_column(ForeignKey("games.id", ondelete="CASCADE"), nullable=False)
     team_name: Mapped[str] = mapped_column(String(80), nullable=False)
     players: Mapped[int] = mapped_column(Integer, nullable=False)
-    status: Mapped[str] = mapped_column(String(16), default="confirmed", nullable=False)  # confirmed|waitlist
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
-    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    status: Mapped[RegStatus] = mapped_column(RegStatusType, default=RegStatus.CONFIRMED, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=utcnow(), server_default=utcnow(), nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime, default=utcnow(), server_default=utcnow(), onupdate=utcnow(), nullable=False
+    )
 
-    game: Mapped["Game"] = relationship(back_populates="registrations")
+    # Ленивую подгрузку запрещаем: игру берём явно через join/joinedload
+    game: Mapped["Game"] = relationship(back_populates="registrations", lazy="raise")
@@ -1,16 +1,27 @@
 from aiogram.fsm.state import StatesGroup, State
 
+# Каждое состояние дублируется модульной константой: хендлеры берут её
+# одним обращением к глобальному имени вместо атрибута класса.
+
 class RegisterFlow(StatesGroup):
     choosing_game = State()
     entering_team_name = State()
     entering_players = State()
 
+CHOOSING_GAME = RegisterFlow.choosing_game
+ENTERING_TEAM_NAME = RegisterFlow.entering_team_name
+ENTERING_PLAYERS = RegisterFlow.entering_players
+
 class EditNameFlow(StatesGroup):
     entering_new_name = State()
 
+ENTERING_NEW_NAME = EditNameFlow.entering_new_name
+
 class EditPlayersFlow(StatesGroup):
     entering_new_players = State()
 
+ENTERING_NEW_PLAYERS = EditPlayersFlow.entering_new_players
+
 class AddGameFlow(StatesGroup):
     entering_title = State()
     entering_when = State()
@@ -20,6 +31,17 @@ class AddGameFlow(StatesGroup):
     entering_max_per_team = State()
     confirming_active = State()
 
+ENTERING_TITLE = AddGameFlow.entering_title
+ENTERING_WHEN = AddGameFlow.entering_when
+ENTERING_LOCATION = AddGameFlow.entering_location
+ENTERING_TEAMS_CAPACITY = AddGameFlow.entering_teams_capacity
+ENTERING_PEOPLE_CAPACITY = AddGameFlow.entering_people_capacity
+ENTERING_MAX_PER_TEAM = AddGameFlow.entering_max_per_team
+CONFIRMING_ACTIVE = AddGameFlow.confirming_active
+
 class AdminAddTeamFlow(StatesGroup):
     entering_team_name = State()
     entering_players = State()
+
+ADMIN_ENTERING_TEAM_NAME = AdminAddTeamFlow.entering_team_name
+ADMIN_ENTERING_PLAYERS = AdminAddTeamFlow.entering_players
@@ -1,27 +1,95 @@
+import re
 from datetime import datetime
+from functools import lru_cache
 from zoneinfo import ZoneInfo
-from config import settings
+from config import get_settings
+
+settings = get_settings()
+
+# Часовой пояс читается из tzdata один раз при импорте; при неизвестном TZ — naive datetime
+try:
+    _TZ = ZoneInfo(settings.tz)
+except Exception:
+    _TZ = None
+
+# Ответы «пропустить» в мастерах ввода
+SKIP_TOKENS = frozenset({"", "skip", "нет", "не", "пропуск"})
+# Длиннее самого длинного токена — точно не «пропустить», lower() не нужен
+_SKIP_MAXLEN = max(map(len, SKIP_TOKENS))
+
+# Поддерживаемые форматы: YYYY-MM-DD[ HH:MM] и DD.MM.YYYY[ HH:MM].
+# Полные формы (с ведущими нулями) разбираются по позициям: ISO — через
+# datetime.fromisoformat, DD.MM.YYYY — срезами. Всё остальное (сокращённые
+# записи вроде «1.3.2025 9:05», лишние пробелы) разбирает regex.
+# Поля — те же шаблоны, что strptime строит для %d/%m/%Y/%H/%M, а пробел между
+# датой и временем — любой пробельный промежуток, как пробел в его формате
+_D, _M, _Y = r"(3[01]|[12]\d|0[1-9]|[1-9]| [1-9])", r"(1[0-2]|0[1-9]|[1-9])", r"(\d\d\d\d)"
+_TIME = r"(?:\s+(2[0-3]|[01]\d|\d):([0-5]\d|\d))?"
+_ISO_DT_RE = re.compile(rf"{_Y}-{_M}-{_D}{_TIME}")
+_RU_DT_RE = re.compile(rf"{_D}\.{_M}\.{_Y}{_TIME}")
+
+def _parse_full_shape(s: str) -> datetime | None | bool:
+    """
+    Разбор строки фиксированной длины (10 или 16 символов).
+    False — строка не той формы; None — форма та, но дата невалидна.
+    Все позиции цифр проверяются заранее: int() и fromisoformat пропустили бы
+    знак, «_» или пробел, которых прежний разбор не принимал.
+    """
+    n = len(s)
+    if not s.isascii() or not (n == 10 or n == 16 and s[10] == " " and s[13] == ":"):
+        return False
+    if n == 16 and not (s[11:13] + s[14:16]).isdigit():
+        return False
+    iso = s[4] == "-" and s[7] == "-"
+    if iso:
+        digits = s[0:4] + s[5:7] + s[8:10]
+    elif s[2] == "." and s[5] == ".":
+        digits = s[0:2] + s[3:5] + s[6:10]
+    else:
+        return False
+    if not digits.isdigit():
+        return False
+    try:
+        if iso:
+            return datetime.fromisoformat(s)
+        return datetime(int(s[6:10]), int(s[3:5]), int(s[0:2]), int(s[11:13] or 0), int(s[14:16] or 0))
+    except ValueError:
+        return None
 
 def parse_datetime_maybe(s: str) -> datetime | None:
     s = s.strip()
-    if s.lower() in {"", "skip", "нет", "не", "пропуск"}:
+    if len(s) <= _SKIP_MAXLEN and s.lower() in SKIP_TOKENS:
         return None
-    fmts = ["%Y-%m-%d %H:%M", "%d.%m.%Y %H:%M", "%Y-%m-%d", "%d.%m.%Y"]
-    for f in fmts:
+    dt = _parse_full_shape(s)
+    if dt is None:
+        return None
+    if dt is False:
+        m = _ISO_DT_RE.fullmatch(s)
+        if m:
+            y, mo, d, hh, mm = m.groups(default="0")
+        else:
+            m = _RU_DT_RE.fullmatch(s)
+            if not m:
+                return None
+            d, mo, y, hh, mm = m.groups(default="0")
         try:
-            dt = datetime.strptime(s, f)
-            try:
-                return dt.replace(tzinfo=ZoneInfo(settings.tz))
-            except Exception:
-                return dt
+            dt = datetime(int(y), int(mo), int(d), int(hh), int(mm))
         except ValueError:
-            continue
-    return None
+            return None
+    return dt.replace(tzinfo=_TZ) if _TZ is not None else dt
 
-def fmt_dt(dt: datetime | None) -> str:
-    if not dt:
-        return "—"
+@lru_cache(maxsize=1024)
+def _fmt_dt_cached(dt: datetime) -> str:
     try:
-        return dt.strftime("%d.%m.%Y %H:%M")
+        return f"{dt.day:02d}.{dt.month:02d}.{dt.year:04d} {dt.hour:02d}:{dt.minute:02d}"
     except Exception:
         return str(dt)
+
+def fmt_dt(dt: datetime | None) -> str:
+    if dt is None:
+        return "—"
+    # Aware-datetime сравниваются по UTC: ключом кэша служит «настенное» время,
+    # которое и выводится, иначе 19:00+03 и 16:00+00 делили бы одну запись
+    if dt.tzinfo is not None:
+        dt = dt.replace(tzinfo=None)
+    return _fmt_dt_cached(dt)